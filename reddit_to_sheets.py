@@ -4,16 +4,66 @@ print("GOOGLE_SHEET_ID present?", bool(os.getenv("GOOGLE_SHEET_ID")))
 print("SERVICE JSON present?", bool(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")))
 print("Working directory files:", os.listdir("."))
 print("=== END PRECHECK ===")
-import json
+import logging
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
+from logging.handlers import BufferingHandler
 
+import orjson
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 import gspread
+from gspread.utils import absolute_range_name, rowcol_to_a1
 from google.oauth2.service_account import Credentials
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer, normalize
+
+# libyaml's C loader when PyYAML was built with it; the pure-Python one otherwise
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+
+# ---------- Logging ----------
+
+class BatchedStdoutHandler(BufferingHandler):
+    """
+    Collects log lines and writes them to stdout in one write() per batch,
+    instead of one write + flush per line. Warnings and errors flush right away.
+    """
+
+    def __init__(self, capacity: int = 100):
+        super().__init__(capacity)
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return super().shouldFlush(record) or record.levelno >= logging.WARNING
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                sys.stdout.write("".join(self.format(r) + "\n" for r in self.buffer))
+                sys.stdout.flush()
+                self.buffer.clear()
+        finally:
+            self.release()
+
+
+# Only this script's records go through the buffer; library loggers are left alone
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+LOG_HANDLER = BatchedStdoutHandler()
+log.addHandler(LOG_HANDLER)
+log.propagate = False
 
 
 # ---------- Helpers ----------
@@ -29,74 +79,283 @@ def utc_now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
+# Google Sheets tab name rules: max 100 chars; cannot contain: : \ / ? * [ ]
+_SHEET_TITLE_TABLE = str.maketrans({c: " " for c in ":\\/?*[]"})
+
+
 def safe_sheet_title(title: str) -> str:
-    # Google Sheets tab name rules: max 100 chars; cannot contain: : \ / ? * [ ]
-    bad = [":", "\\", "/", "?", "*", "[", "]"]
-    for b in bad:
-        title = title.replace(b, " ")
+    title = title.translate(_SHEET_TITLE_TABLE)
     title = " ".join(title.split()).strip()
     return title[:100] if title else "Topic"
 
 
-def sentiment_label(score: float) -> str:
-    if score >= 0.05:
-        return "positive"
-    if score <= -0.05:
-        return "negative"
-    return "neutral"
+class CompoundOnlyAnalyzer(SentimentIntensityAnalyzer):
+    """
+    VADER that only computes the compound score. We never read pos/neu/neg,
+    so the per-text sift and ratio work in score_valence is skipped.
+    """
+
+    def score_valence(self, sentiments, text):
+        if not sentiments:
+            return {"compound": 0.0}
+        sum_s = float(sum(sentiments))
+        # compute and add emphasis from punctuation in text
+        punct_emph_amplifier = self._punctuation_emphasis(text)
+        if sum_s > 0:
+            sum_s += punct_emph_amplifier
+        elif sum_s < 0:
+            sum_s -= punct_emph_amplifier
+        return {"compound": round(normalize(sum_s), 4)}
+
+
+ANALYZER = CompoundOnlyAnalyzer()
+
+
+@lru_cache(maxsize=4096)
+def vader_compound(text: str) -> float:
+    # Cross-posted titles repeat a lot, so identical titles are scored once
+    return ANALYZER.polarity_scores(text)["compound"]
+
+
+def sentiment_labels(scores: pd.Series) -> pd.Series:
+    # >= 0.05 positive, <= -0.05 negative, neutral in between; one pass over the column
+    labels = np.select([scores >= 0.05, scores <= -0.05], ["positive", "negative"], default="neutral")
+    return pd.Series(labels, index=scores.index, dtype=object)
 
 
 # ---------- Reddit fetching (no Reddit API keys needed) ----------
 
-def fetch_subreddit_posts(subreddit: str, limit: int, user_agent: str) -> list[dict]:
-    url = f"https://www.reddit.com/r/{subreddit}/new.json"
+REDDIT_BASE = "https://www.reddit.com"
+FETCH_WORKERS = 4
+
+# The only post fields we keep; posts are carried around as tuples in this order
+POST_FIELDS = ("id", "title", "created_utc", "score", "num_comments", "permalink")
+
+# Progressive backoff on 429 helps a lot on GitHub Actions IP ranges.
+# Each retry still takes a token from the shared RateLimiter, so the overall request rate stays bounded.
+RATE_LIMIT_BACKOFF_SECONDS = [2, 5, 10, 20]
+
+# One keep-alive session for every subreddit, so we pay the TLS handshake once.
+# Transient 5xx errors are retried by urllib3; 429s are handled in fetch_all_subreddits.
+SESSION = requests.Session()
+SESSION.headers["Accept"] = "application/json"
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=FETCH_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1.5,
+            status_forcelist=[500, 502, 503, 504],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+class RedditRateLimited(RuntimeError):
+    def __init__(self, subreddit: str, retry_after: float | None = None):
+        super().__init__(f"Reddit kept rate-limiting (HTTP 429) for r/{subreddit}")
+        self.retry_after = retry_after
+
+
+# ETag / Last-Modified from the previous run (kept by actions/cache in CI)
+ETAG_CACHE_PATH = os.path.join(".cache", "reddit_etags.json")
+
+
+def etag_cache_key(subreddit: str, limit: int, tab_titles: set[str]) -> str:
+    # A 304 only means "nothing new" for the same listing size feeding the same tabs
+    return orjson.dumps([subreddit, limit, sorted(tab_titles)]).decode()
+
+
+def load_etag_cache(path: str = ETAG_CACHE_PATH) -> dict[str, dict]:
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if isinstance(v, dict)}
+
+
+def save_etag_cache(etags: dict[str, dict], path: str = ETAG_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(etags))
+
+
+def fetch_subreddit_posts(
+    subreddit: str, limit: int, etags: dict[str, dict] | None = None, etag_key: str | None = None
+) -> list[tuple]:
+    """
+    Returns the newest non-stickied posts of a subreddit.
+    When `etags` is given, sends a conditional GET with the validators stored under
+    `etag_key` (default: the subreddit) and returns [] if the listing hasn't changed;
+    on 200 the validators are updated.
+    """
+    etag_key = etag_key or subreddit
+    url = f"{REDDIT_BASE}/r/{subreddit}/new.json"
     params = {"limit": str(limit)}
-    headers = {
-        "User-Agent": user_agent,
-        "Accept": "application/json",
-    }
-
-    # Progressive backoff helps a lot on GitHub Actions IP ranges
-    backoff_seconds = [2, 5, 10, 20]
-    last_status = None
-    last_preview = ""
-
-    for attempt, wait_s in enumerate([0] + backoff_seconds, start=1):
-        if wait_s:
-            time.sleep(wait_s)
 
-        r = requests.get(url, params=params, headers=headers, timeout=30)
-        last_status = r.status_code
-        last_preview = (r.text or "")[:120].replace("\n", " ")
-        print(f"  Reddit: r/{subreddit} attempt {attempt} → HTTP {last_status} ({last_preview})")
-
-        if r.status_code == 200:
-            data = r.json()
-            children = data.get("data", {}).get("children", [])
-            posts = []
-            for c in children:
-                p = c.get("data", {})
-                if p.get("stickied"):
-                    continue
-                posts.append(p)
-            print(f"  Reddit: r/{subreddit} got {len(posts)} posts")
-            return posts
-
-        # If rate-limited, retry
-        if r.status_code == 429:
-            continue
+    headers = {}
+    cached = (etags or {}).get(etag_key, {})
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    r = SESSION.get(url, params=params, headers=headers, timeout=30)
+    if r.status_code == 304:
+        log.info("  Reddit: r/%s → HTTP 304 (unchanged since last run)", subreddit)
+        return []
+
+    # Decode just the first bytes for the log line, not the whole (often 100s of KB) body
+    preview = r.content[:120].decode("utf-8", "replace").replace("\n", " ")
+    log.info("  Reddit: r/%s → HTTP %s (%s)", subreddit, r.status_code, preview)
+
+    if r.status_code == 429:
+        retry_after = r.headers.get("Retry-After", "")
+        raise RedditRateLimited(subreddit, float(retry_after) if retry_after.isdigit() else None)
+    if r.status_code != 200:
+        raise RuntimeError(f"Reddit HTTP {r.status_code} for r/{subreddit}: {preview}")
+
+    data = orjson.loads(r.content)
+    children = data.get("data", {}).get("children", [])
+    # Project each post down to POST_FIELDS straight away instead of keeping 100-key dicts
+    posts = [
+        tuple(p.get(f) for f in POST_FIELDS)
+        for c in children
+        if not (p := c.get("data", {})).get("stickied")
+    ]
+    log.info("  Reddit: r/%s got %d posts", subreddit, len(posts))
+
+    if etags is not None and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+        etags[etag_key] = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    return posts
 
-        # Other failures: stop retrying for this subreddit
-        raise RuntimeError(f"Reddit HTTP {r.status_code} for r/{subreddit}: {last_preview}")
 
-    raise RuntimeError(f"Reddit kept rate-limiting (HTTP 429) for r/{subreddit}")
+class RateLimiter:
+    """
+    Hands out one token every `interval` seconds across all threads,
+    so parallel fetches stay under Reddit's request-rate limit.
+    """
 
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_s = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+
+def fetch_all_subreddits(
+    subreddits: list[str],
+    limit: int,
+    request_sleep: float,
+    etags: dict[str, dict] | None = None,
+    etag_keys: dict[str, str] | None = None,
+) -> dict[str, list[tuple] | Exception]:
+    """
+    Fetches every subreddit concurrently (at most one request per
+    request_sleep seconds overall). Each subreddit maps to its posts,
+    or to the exception raised while fetching it.
+    """
+    limiter = RateLimiter(request_sleep)
+
+    def fetch_one(sub: str) -> list[tuple] | Exception:
+        log.info("Fetching r/%s ...", sub)
+        error = None
+        for attempt, backoff_s in enumerate([0] + RATE_LIMIT_BACKOFF_SECONDS, start=1):
+            if error is not None:
+                wait_s = max(backoff_s, error.retry_after or 0)
+                log.info("  Reddit: r/%s rate-limited, retrying in %ss (attempt %d)", sub, wait_s, attempt)
+                time.sleep(wait_s)
+            limiter.wait()
+            try:
+                return fetch_subreddit_posts(sub, limit=limit, etags=etags, etag_key=(etag_keys or {}).get(sub))
+            except RedditRateLimited as e:
+                error = e
+            except Exception as e:
+                return e
+        return error
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        return dict(zip(subreddits, executor.map(fetch_one, subreddits)))
+
+
+# ---------- Row building ----------
+
+POST_HEADERS = (
+    "post_id",
+    "run_time_utc",
+    "topic",
+    "subreddit",
+    "created_utc",
+    "title",
+    "sentiment_compound",
+    "sentiment_label",
+    "score_upvotes",
+    "num_comments",
+    "permalink",
+)
+ROLLUP_HEADERS = (
+    "run_time_utc",
+    "topic",
+    "subreddit",
+    "new_posts_added",
+    "avg_compound_sentiment",
+)
+
+
+def _int_column(values: pd.Series) -> pd.Series:
+    # A single missing value makes from_records store the column as float64;
+    # go through nullable Int64 so counts stay ints and gaps become ""
+    return values.astype("Int64").astype(object).fillna("")
+
+
+def build_post_rows(posts: list[tuple], existing_ids: set[str], run_time: str, topic_name: str, subreddit: str) -> pd.DataFrame:
+    """
+    Turns one subreddit's posts into sheet rows (one column per sheet header, in order),
+    skipping posts that are already in the sheet or have no title.
+    Timestamps and permalinks are formatted column-wise rather than per post.
+    """
+    df = pd.DataFrame.from_records(posts, columns=POST_FIELDS)
+    df["id"] = df["id"].fillna("").astype(str)
+    df["title"] = df["title"].fillna("").astype(str).str.strip()
+    df = df[(df["id"] != "") & ~df["id"].isin(existing_ids) & (df["title"] != "")]
+    df = df.drop_duplicates("id")
+
+    compound = df["title"].map(vader_compound)
+    created_utc = pd.to_datetime(df["created_utc"], unit="s", utc=True).dt.strftime("%Y-%m-%d %H:%M:%S UTC")
+
+    return pd.DataFrame({
+        "post_id": df["id"],
+        "run_time_utc": run_time,
+        "topic": topic_name,
+        "subreddit": subreddit,
+        "created_utc": created_utc.fillna(""),
+        "title": df["title"],
+        "sentiment_compound": compound,
+        "sentiment_label": sentiment_labels(compound),
+        "score_upvotes": _int_column(df["score"]),
+        "num_comments": _int_column(df["num_comments"]),
+        "permalink": REDDIT_BASE + df["permalink"].fillna(""),
+    })
 
 
 # ---------- Google Sheets ----------
 
 def connect_gsheet(service_json: str, sheet_id: str):
-    creds_dict = json.loads(service_json)
+    creds_dict = orjson.loads(service_json)
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
@@ -107,195 +366,267 @@ def connect_gsheet(service_json: str, sheet_id: str):
     return sh
 
 
-def ensure_worksheet(sh, title: str, headers: list[str]):
-    title = safe_sheet_title(title)
-    try:
-        ws = sh.worksheet(title)
-    except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=title, rows=1000, cols=max(10, len(headers)))
+# New tabs start with room for many runs; appendCells grows the grid past that on its own
+NEW_TAB_ROWS = 5000
+
+# Tabs known to have a header row, so later calls in this process skip the check
+_HEADER_WRITTEN: set[str] = set()
+
+
+def ensure_worksheets(sh, tabs: dict[str, tuple[str, ...]]) -> tuple[dict, set[str]]:
+    """
+    Makes sure every tab in `tabs` (title -> headers) exists and has a header row.
+    Uses at most four API calls no matter how many tabs there are:
+    one metadata read, one addSheet batch for missing tabs (its replies give us the
+    new worksheets), one batchGet of the header rows we haven't seen yet and one
+    values batchUpdate for the empty ones.
+    Returns ({title: worksheet} keyed by the titles passed in, set of sheet titles
+    that were created or had an empty row 1 this call).
+    """
+    safe_titles = {title: safe_sheet_title(title) for title in tabs}
+    wanted = {safe_titles[title]: headers for title, headers in tabs.items()}
+
+    worksheets = {ws.title: ws for ws in sh.worksheets()}
+    missing = [t for t in wanted if t not in worksheets]
+    if missing:
+        res = sh.batch_update({
+            "requests": [
+                {
+                    "addSheet": {
+                        "properties": {
+                            "title": t,
+                            "gridProperties": {"rowCount": NEW_TAB_ROWS, "columnCount": len(wanted[t])},
+                        }
+                    }
+                }
+                for t in missing
+            ]
+        })
+        # The replies carry each new sheet's properties, so there's no need to re-read metadata
+        for reply in res["replies"]:
+            props = reply["addSheet"]["properties"]
+            worksheets[props["title"]] = gspread.Worksheet(sh, props, sh.id, sh.client)
+
+    # Freshly added tabs are known to be empty; only read row 1 of tabs we haven't checked yet
+    need_headers = list(missing)
+    to_check = [t for t in wanted if t not in missing and t not in _HEADER_WRITTEN]
+    if to_check:
+        first_rows = sh.values_batch_get([absolute_range_name(t, "1:1") for t in to_check]).get("valueRanges", [])
+        need_headers += [
+            t for t, vr in zip(to_check, first_rows)
+            if not any(str(c).strip() for row in vr.get("values", []) for c in row)
+        ]
+
+    # Force headers into row 1 wherever it's empty
+    if need_headers:
+        sh.values_batch_update({
+            "valueInputOption": "RAW",
+            "data": [{"range": absolute_range_name(t, "A1"), "values": [list(wanted[t])]} for t in need_headers],
+        })
+    _HEADER_WRITTEN.update(wanted)
 
-    # Force headers into row 1 if it's empty
-    first_row = ws.row_values(1)
-    if not first_row or all(str(c).strip() == "" for c in first_row):
-        ws.update("A1", [headers])
+    return {title: worksheets[safe_titles[title]] for title in tabs}, set(need_headers)
 
-    return ws
 
+def ensure_worksheet(sh, title: str, headers: tuple[str, ...]):
+    return ensure_worksheets(sh, {title: headers})[0][title]
 
-def get_existing_post_ids(ws, post_id_col_index: int = 1, max_rows: int = 2000) -> set[str]:
+
+def get_existing_post_ids(ws, post_id_col_index: int = 1) -> set[str]:
     """
-    Reads up to max_rows rows and returns the set of existing post IDs.
+    Reads the post ID column and returns the set of existing post IDs.
     post_id_col_index is 1-based (Google Sheets style).
     """
-    values = ws.get_all_values()
-    if len(values) <= 1:
-        return set()
+    # Only fetch the one column we need instead of the whole sheet
+    col = rowcol_to_a1(1, post_id_col_index).rstrip("1")
+    values = ws.get(f"{col}2:{col}", value_render_option="UNFORMATTED_VALUE")
 
-    # Skip header row
     ids = set()
-    for row in values[1:max_rows]:
-        if len(row) >= post_id_col_index and row[post_id_col_index - 1].strip():
-            ids.add(row[post_id_col_index - 1].strip())
+    for row in values:
+        if row and str(row[0]).strip():
+            ids.add(str(row[0]).strip())
     return ids
 
 
-def append_rows(ws, rows: list[list], chunk_size: int = 200):
-    # Google Sheets has limits; batch in chunks
-    for i in range(0, len(rows), chunk_size):
-        ws.append_rows(rows[i:i + chunk_size], value_input_option="RAW")
+def _cell(value) -> dict:
+    # Typed cell for appendCells; strings are stored as-is, like valueInputOption=RAW
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def write_rows(sh, writes: list[tuple], chunk_rows: int = 5000):
+    """
+    Appends every (worksheet, rows) block with appendCells requests in one
+    spreadsheets.batchUpdate (a new request every chunk_rows rows).
+    Sheets appends after the last row with data and grows the grid itself,
+    so rows added by an overlapping run or by hand are never overwritten.
+    """
+    batch, batch_rows = [], 0
+    for ws, rows in writes:
+        for i in range(0, len(rows), chunk_rows):
+            piece = rows[i:i + chunk_rows]
+            if batch and batch_rows + len(piece) > chunk_rows:
+                sh.batch_update({"requests": batch})
+                batch, batch_rows = [], 0
+            batch.append({
+                "appendCells": {
+                    "sheetId": ws.id,
+                    "rows": [{"values": [_cell(v) for v in row]} for row in piece],
+                    "fields": "userEnteredValue",
+                }
+            })
+            batch_rows += len(piece)
+    if batch:
+        sh.batch_update({"requests": batch})
 
 
 # ---------- Main ----------
 
 def main():
-    print("=== Reddit → Sheets run starting ===")
+    log.info("=== Reddit → Sheets run starting ===")
+    # One timestamp for the whole run, shared by every row written
+    run_time = utc_now_iso()
     sheet_id = env("GOOGLE_SHEET_ID")
     service_json = env("GOOGLE_SERVICE_ACCOUNT_JSON")
     user_agent = env("REDDIT_USER_AGENT", default="sentiment-bot/1.0", required=False)
 
     request_sleep = float(env("REQUEST_SLEEP_SECONDS", default="1.5", required=False))
     per_subreddit_limit = int(env("POSTS_PER_SUBREDDIT", default="25", required=False))
+    run_smoke_test = env("RUN_SMOKE_TEST", default="0", required=False) == "1"
 
-    print("Time:", utc_now_iso())
-    print("Sheet ID present:", bool(sheet_id))
-    print("Service JSON present:", bool(service_json))
-    print("User-Agent:", user_agent)
-    print("Posts per subreddit:", per_subreddit_limit)
-    print("Sleep seconds:", request_sleep)
+    log.info("Time: %s", run_time)
+    log.info("Sheet ID present: %s", bool(sheet_id))
+    log.info("Service JSON present: %s", bool(service_json))
+    log.info("User-Agent: %s", user_agent)
+    log.info("Posts per subreddit: %s", per_subreddit_limit)
+    log.info("Sleep seconds: %s", request_sleep)
+    log.info("Smoke test: %s", run_smoke_test)
+
+    SESSION.headers["User-Agent"] = user_agent
 
     # Load topics.yml
     if not os.path.exists("topics.yml"):
         raise RuntimeError("topics.yml not found in repo root.")
     with open("topics.yml", "r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
+        cfg = yaml.load(f, Loader=YamlLoader) or {}
     topics = cfg.get("topics", [])
     if not topics:
         raise RuntimeError("No topics found in topics.yml (expected a 'topics:' list).")
+    # An empty `subreddits:` key parses as None; normalise once so every loop below agrees
+    for topic in topics:
+        topic["subreddits"] = topic.get("subreddits") or []
 
     # Connect to sheet
     sh = connect_gsheet(service_json, sheet_id)
-    # --- SMOKE TEST: prove we can write at least one cell ---
-    try:
-        smoke = ensure_worksheet(sh, "SMOKE_TEST", ["status", "time_utc"])
-        smoke.append_row(["hello from github actions", utc_now_iso()], value_input_option="RAW")
-        print("SMOKE TEST: wrote a row to SMOKE_TEST")
-    except Exception as e:
-        print("SMOKE TEST FAILED:", repr(e))
-        raise
-
-    analyzer = SentimentIntensityAnalyzer()
+    # --- SMOKE TEST: prove we can write at least one cell (opt-in via RUN_SMOKE_TEST=1) ---
+    if run_smoke_test:
+        try:
+            smoke = ensure_worksheet(sh, "SMOKE_TEST", ("status", "time_utc"))
+            smoke.append_row(["hello from github actions", run_time], value_input_option="RAW")
+            log.info("SMOKE TEST: wrote a row to SMOKE_TEST")
+        except Exception as e:
+            log.error("SMOKE TEST FAILED: %r", e)
+            raise
 
     rollup_rows = []
-    rollup_headers = [
-        "run_time_utc",
-        "topic",
-        "subreddit",
-        "new_posts_added",
-        "avg_compound_sentiment",
-    ]
-    rollup_ws = ensure_worksheet(sh, "Rollup", rollup_headers)
+
+    # Create / fix up every tab in one go instead of a few round-trips per topic
+    tabs = {"Rollup": ROLLUP_HEADERS}
+    for topic in topics:
+        if topic["subreddits"]:
+            tabs[topic.get("name", "Topic")] = POST_HEADERS
+    worksheets, fresh_tabs = ensure_worksheets(sh, tabs)
+    rollup_ws = worksheets["Rollup"]
+
+    # Which tabs each subreddit feeds; a subreddit shared by several topics is fetched once
+    sub_tabs = {}
+    for topic in topics:
+        for sub in topic["subreddits"]:
+            sub_tabs.setdefault(sub, set()).add(worksheets[topic.get("name", "Topic")].title)
+
+    etags = load_etag_cache()
+    etag_keys = {sub: etag_cache_key(sub, per_subreddit_limit, titles) for sub, titles in sub_tabs.items()}
+    for sub, titles in sub_tabs.items():
+        if titles & fresh_tabs:
+            # A new or emptied tab needs the full listing, not a 304
+            etags.pop(etag_keys[sub], None)
+
+    # Fetch every subreddit up front
+    fetched = fetch_all_subreddits(
+        list(sub_tabs), limit=per_subreddit_limit, request_sleep=request_sleep, etags=etags, etag_keys=etag_keys
+    )
+
+    # Everything is appended at the end in one batch: (worksheet, rows)
+    writes = []
+    # Existing IDs per tab, shared by topics that map to the same tab
+    tab_ids = {}
 
     for topic in topics:
         topic_name = topic.get("name", "Topic")
-        subs = topic.get("subreddits", [])
+        subs = topic["subreddits"]
         if not subs:
-            print(f"Skipping topic '{topic_name}' (no subreddits listed).")
+            log.info("Skipping topic '%s' (no subreddits listed).", topic_name)
             continue
 
-        headers = [
-            "post_id",
-            "run_time_utc",
-            "topic",
-            "subreddit",
-            "created_utc",
-            "title",
-            "sentiment_compound",
-            "sentiment_label",
-            "score_upvotes",
-            "num_comments",
-            "permalink",
-        ]
-        ws = ensure_worksheet(sh, topic_name, headers)
-        existing_ids = get_existing_post_ids(ws, post_id_col_index=1)
+        ws = worksheets[topic_name]
+        if ws.id not in tab_ids:
+            tab_ids[ws.id] = get_existing_post_ids(ws, post_id_col_index=1)
+        existing_ids = tab_ids[ws.id]
 
-        print(f"\n--- Topic: {topic_name} ---")
+        log.info("\n--- Topic: %s ---", topic_name)
         topic_new_rows = []
         topic_scores = []
 
         for sub in subs:
-            print(f"Fetching r/{sub} ...")
-            try:
-                posts = fetch_subreddit_posts(sub, limit=per_subreddit_limit, user_agent=user_agent)
-            except Exception as e:
-                print(f"  !! Error fetching r/{sub}: {e}")
+            posts = fetched[sub]
+            if isinstance(posts, Exception):
+                log.warning("  !! Error fetching r/%s: %s", sub, posts)
                 continue
 
-            new_added = 0
-            sub_scores = []
-
-            for p in posts:
-                post_id = p.get("id", "")
-                if not post_id or post_id in existing_ids:
-                    continue
-
-                title = (p.get("title") or "").strip()
-                if not title:
-                    continue
-
-                compound = analyzer.polarity_scores(title)["compound"]
-                label = sentiment_label(compound)
-
-                created_utc = p.get("created_utc", "")
-                if created_utc:
-                    created_utc = datetime.fromtimestamp(float(created_utc), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-
-                permalink = "https://www.reddit.com" + (p.get("permalink") or "")
-
-                row = [
-                    post_id,
-                    utc_now_iso(),
-                    topic_name,
-                    sub,
-                    created_utc,
-                    title,
-                    compound,
-                    label,
-                    p.get("score", ""),
-                    p.get("num_comments", ""),
-                    permalink,
-                ]
-                topic_new_rows.append(row)
-                existing_ids.add(post_id)
-                new_added += 1
-                sub_scores.append(compound)
+            rows = build_post_rows(posts, existing_ids, run_time, topic_name, sub)
+            topic_new_rows.extend(rows.values.tolist())
+            existing_ids.update(rows["post_id"])
+            new_added = len(rows)
+            sub_scores = rows["sentiment_compound"].tolist()
 
             if sub_scores:
                 sub_avg = sum(sub_scores) / len(sub_scores)
             else:
                 sub_avg = 0.0
 
-            rollup_rows.append([utc_now_iso(), topic_name, sub, new_added, sub_avg])
+            rollup_rows.append([run_time, topic_name, sub, new_added, sub_avg])
 
             topic_scores.extend(sub_scores)
 
-            time.sleep(request_sleep)
-
         if topic_new_rows:
-            print(f"Adding {len(topic_new_rows)} new rows to sheet tab '{safe_sheet_title(topic_name)}' ...")
-            append_rows(ws, topic_new_rows)
+            log.info("Adding %d new rows to sheet tab '%s' ...", len(topic_new_rows), ws.title)
+            writes.append((ws, topic_new_rows))
         else:
-            print("No new rows to add for this topic (maybe duplicates or no fresh posts).")
+            log.info("No new rows to add for this topic (maybe duplicates or no fresh posts).")
 
-    # Write rollup
+    # Write all topic rows and the rollup in one request
     if rollup_rows:
-        append_rows(rollup_ws, rollup_rows)
+        writes.append((rollup_ws, rollup_rows))
+    write_rows(sh, writes)
 
-    print("\n=== Done. Check your Google Sheet tabs (including 'Rollup') ===")
+    # Only remember validators once the rows they cover are safely in the sheet
+    save_etag_cache({key: etags[key] for key in etag_keys.values() if key in etags})
+
+    log.info("\n=== Done. Check your Google Sheet tabs (including 'Rollup') ===")
 
 
 if __name__ == "__main__":
-    main()
-print("=== SCRIPT END (reached end of file) ===")
+    # Flush buffered INFO lines before a traceback is printed (or the runner kills the job)
+    try:
+        main()
+    finally:
+        LOG_HANDLER.flush()
+log.info("=== SCRIPT END (reached end of file) ===")
 
 
 